@@ -7,16 +7,21 @@
 """
 
 import os
+import csv
 import argparse
 import logging
+import pickle
 from pathlib import Path
 import statistics
 import bisect
-from typing import Iterator, NamedTuple
+from functools import cache
+import sys
+from typing import Iterable, Iterator, NamedTuple
 import reccmp
 from reccmp.isledecomp import PEImage
 from reccmp.isledecomp.compare.db import ReccmpEntity
 from reccmp.isledecomp.cvdump import Cvdump
+from reccmp.isledecomp.cvdump.parser import ModuleEntry, SizeRefEntry
 from reccmp.isledecomp.compare import Compare as IsleCompare
 from reccmp.isledecomp.formats.exceptions import InvalidVirtualAddressError
 from reccmp.isledecomp.types import EntityType
@@ -35,28 +40,91 @@ def or_blank(value) -> str:
     return "" if value is None else str(value)
 
 
+# Change this if the cached data changes shape, e.g. new fields in
+# ModuleEntry or SizeRefEntry, so that old cache files are not used.
+PDB_CACHE_FORMAT = 1
+
+
+def read_pdb_modules(pdb: Path) -> tuple[list[ModuleEntry], list[SizeRefEntry]]:
+    """Get the modules and section contributions from the pdb using cvdump.
+    The result is saved to a cache file next to the pdb and reused on the
+    next run, as long as the pdb has the same modified time and size."""
+    cache_file = pdb.with_name(pdb.name + ".reccmp-cache")
+    pdb_stat = pdb.stat()
+    cache_key = (
+        pdb_stat.st_mtime_ns,
+        pdb_stat.st_size,
+        reccmp.VERSION,
+        PDB_CACHE_FORMAT,
+    )
+
+    try:
+        with cache_file.open("rb") as f:
+            (key, modules, sizerefs) = pickle.load(f)
+
+        if key == cache_key:
+            return (modules, sizerefs)
+    except FileNotFoundError:
+        pass
+    # pylint: disable=broad-exception-caught
+    # A corrupt or outdated cache file could raise almost anything.
+    # We will replace it with a new one.
+    except Exception:
+        logger.debug("Ignoring unreadable cache file %s", cache_file)
+
+    cvdump = Cvdump(str(pdb)).section_contributions().modules().run()
+
+    # Write to a temp file first so another process never reads a partial file.
+    temp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    try:
+        with temp_file.open("wb") as f:
+            pickle.dump((cache_key, cvdump.modules, cvdump.sizerefs), f)
+
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        logger.debug("Could not write cache file %s: %s", cache_file, e)
+        temp_file.unlink(missing_ok=True)
+
+    return (cvdump.modules, cvdump.sizerefs)
+
+
 class ModuleMap:
     """Load a subset of sections from the pdb to allow you to look up the
     module number based on the recomp address."""
 
     def __init__(self, pdb: Path, binfile: PEImage) -> None:
-        cvdump = Cvdump(str(pdb)).section_contributions().modules().run()
+        (modules, sizerefs) = read_pdb_modules(pdb)
         self.module_lookup: dict[int, tuple[str, str]] = {
-            m.id: (m.lib, m.obj) for m in cvdump.modules
+            m.id: (m.lib, m.obj) for m in modules
         }
-        self.library_lookup = {m.obj: m.lib for m in cvdump.modules}
-        self.section_contrib = [
+        self.library_lookup = {m.obj: m.lib for m in modules}
+
+        # Base address for each valid section, indexed by the 1-based id
+        # used in the pdb. Sections not in the headers are ignored.
+        section_bases = {
+            i: section.virtual_address
+            for i, section in enumerate(binfile.sections, start=1)
+        }
+
+        # Section contributions are stored as parallel lists (start, size, module)
+        # rather than a list of tuples. This keeps each lookup table compact.
+        self.contrib_starts: list[int] = []
+        self.contrib_sizes: list[int] = []
+        self.contrib_modules: list[int] = []
+
+        # Sort by start address so we can bisect the list of starts.
+        for start, size, module_id in sorted(
             (
-                binfile.get_abs_addr(sizeref.section, sizeref.offset),
+                section_bases[sizeref.section] + sizeref.offset,
                 sizeref.size,
                 sizeref.module,
             )
-            for sizeref in cvdump.sizerefs
-            if binfile.is_valid_section(sizeref.section)
-        ]
-
-        # For bisect performance enhancement
-        self.contrib_starts = [start for (start, _, __) in self.section_contrib]
+            for sizeref in sizerefs
+            if sizeref.section in section_bases
+        ):
+            self.contrib_starts.append(start)
+            self.contrib_sizes.append(size)
+            self.contrib_modules.append(module_id)
 
     def get_lib_for_module(self, module: str) -> str | None:
         return self.library_lookup.get(module)
@@ -69,22 +137,15 @@ def get_all_cmake_modules(self) -> list[str]:
         ]
 
     def get_module(self, addr: int) -> tuple[str, str] | None:
-        i = bisect.bisect_left(self.contrib_starts, addr)
-        # If the addr matches the section contribution start, we are in the
-        # right spot. Otherwise, we need to subtract one here.
-        # We don't want the insertion point given by bisect, but the
-        # section contribution that contains the address.
-
-        (potential_start, _, __) = self.section_contrib[i]
-        if potential_start != addr:
-            i -= 1
-
-        # Safety catch: clamp to range of indices from section_contrib.
-        i = max(0, min(i, len(self.section_contrib) - 1))
-
-        (start, size, module_id) = self.section_contrib[i]
-        if start <= addr < start + size:
-            if (module := self.module_lookup.get(module_id)) is not None:
+        # We want the last section contribution that starts at or before
+        # the given address. If there isn't one, the address is not mapped.
+        i = bisect.bisect_right(self.contrib_starts, addr) - 1
+        if i < 0:
+            return None
+
+        start = self.contrib_starts[i]
+        if start <= addr < start + self.contrib_sizes[i]:
+            if (module := self.module_lookup.get(self.contrib_modules[i])) is not None:
                 return module
 
         return None
@@ -112,6 +173,7 @@ def match_type_abbreviation(mtype: int | None) -> str:
     return EntityType(mtype).name.lower()[:3]
 
 
+@cache
 def get_cmakefiles_prefix(module: str) -> str:
     """For the given .obj, get the "CMakeFiles/something.dir/" prefix.
     For lack of a better option, this is the library for this module."""
@@ -121,6 +183,7 @@ def get_cmakefiles_prefix(module: str) -> str:
     return module
 
 
+@cache
 def truncate_module_name(prefix: str, module: str) -> str:
     """Remove the CMakeFiles prefix and the .obj suffix for the given module.
     Input: CMakeFiles/lego1.dir/, CMakeFiles/lego1.dir/LEGO1/define.cpp.obj
@@ -142,10 +205,15 @@ def avg_remove_outliers(entries: list[int]) -> int:
     if len(entries) == 1:
         return entries[0]
 
-    avg = statistics.mean(entries)
-    sd = statistics.pstdev(entries)
+    # Keep entries within two standard deviations of the mean.
+    # Scale everything by n to stay in integer math:
+    # abs(e - avg) <= 2 * sd  <=>  (n*e - total)**2 <= 4 * (n*sum(e**2) - total**2)
+    n = len(entries)
+    total = sum(entries)
+    limit = 4 * (n * sum(e * e for e in entries) - total * total)
 
-    return int(statistics.mean([e for e in entries if abs(e - avg) <= 2 * sd]))
+    kept = [e for e in entries if (n * e - total) ** 2 <= limit]
+    return sum(kept) // len(kept)
 
 
 class RoadmapRow(NamedTuple):
@@ -181,44 +249,40 @@ def __init__(self, match_type: str = "fun") -> None:
         if match_type in ALLOWED_TYPE_ABBREVIATIONS:
             self.match_type = match_type
 
-    def read_row(self, row: RoadmapRow):
-        if row.module is None:
-            return
-
-        if row.sym_type != self.match_type:
-            return
-
-        if row.orig_addr is not None:
-            if row.module not in self.addresses:
-                self.addresses[row.module] = []
-
-            self.addresses[row.module].append(row.orig_addr)
+    def read_rows(self, rows: Iterable[RoadmapRow]):
+        """Collect the addresses and displacements of each module from the
+        rows that match our symbol type."""
+        for row in rows:
+            if row.module is None or row.sym_type != self.match_type:
+                continue
 
-            if row.orig_addr < self.earliest.get(row.module, 0xFFFFFFFFF):
-                self.earliest[row.module] = row.orig_addr
+            if row.orig_addr is not None:
+                self.addresses.setdefault(row.module, []).append(row.orig_addr)
 
-        if row.displacement is not None:
-            if row.module not in self.disp_map:
-                self.disp_map[row.module] = []
+            if row.displacement is not None:
+                self.disp_map.setdefault(row.module, []).append(row.displacement)
 
-            self.disp_map[row.module].append(row.displacement)
+        # Get the earliest address from the complete list for each module
+        # instead of comparing as we read each row.
+        self.earliest = {mod: min(values) for mod, values in self.addresses.items()}
 
     def iter_sorted(self) -> Iterator[tuple[int, str]]:
         """Compute the average address for each module, then generate them
         in ascending order."""
-        avg_address = {
-            mod: avg_remove_outliers(values) for mod, values in self.addresses.items()
-        }
-        for mod, avg in sorted(avg_address.items(), key=lambda x: x[1]):
-            yield (avg, mod)
+        items = [
+            (avg_remove_outliers(values), mod) for mod, values in self.addresses.items()
+        ]
+        items.sort()
+        yield from items
 
 
-def suggest_order(results: list[RoadmapRow], module_map: ModuleMap, match_type: str):
+def suggest_order(
+    results: Iterable[RoadmapRow], module_map: ModuleMap, match_type: str
+):
     """Suggest the order of modules for CMakeLists.txt"""
 
     dc = DeltaCollector(match_type)
-    for row in results:
-        dc.read_row(row)
+    dc.read_rows(results)
 
     # First, show the order of .obj files for the "CMake Modules"
     # Meaning: the modules where the .obj file begins with "CMakeFiles".
@@ -231,21 +295,30 @@ def suggest_order(results: list[RoadmapRow], module_map: ModuleMap, match_type:
     # of the string with '/' as the delimiter.
     # i.e. CMakeFiles/isle.dir/
     # The idea is to print exactly what appears in CMakeLists.txt.
-    cmake_prefixes = sorted(set(get_cmakefiles_prefix(mod) for mod in leftover_modules))
+    leftover_by_prefix: dict[str, set[str]] = {}
+    for module in leftover_modules:
+        leftover_by_prefix.setdefault(get_cmakefiles_prefix(module), set()).add(module)
+
+    cmake_prefixes = sorted(leftover_by_prefix.keys())
 
     # Save this off because we'll use it again later.
     computed_order = list(dc.iter_sorted())
 
+    # Group the computed order by prefix so each library
+    # only needs to visit its own modules.
+    computed_by_prefix: dict[str, list[str]] = {}
+    for _, module in computed_order:
+        computed_by_prefix.setdefault(get_cmakefiles_prefix(module), []).append(module)
+
     for prefix in cmake_prefixes:
         print(prefix)
 
+        leftovers = leftover_by_prefix[prefix]
+
         last_earliest = 0
         # Show modules ordered by the computed average of addresses
-        for _, module in computed_order:
-            if not module.startswith(prefix):
-                continue
-
-            leftover_modules.remove(module)
+        for module in computed_by_prefix.get(prefix, []):
+            leftovers.remove(module)
 
             avg_displacement = None
             displacements = dc.disp_map.get(module)
@@ -271,10 +344,7 @@ def suggest_order(results: list[RoadmapRow], module_map: ModuleMap, match_type:
         # In other words: don't take the list we provide as the final word on
         # what should or should not be included.
         # This is merely a suggestion of the order.
-        for module in leftover_modules:
-            if not module.startswith(prefix):
-                continue
-
+        for module in leftovers:
             # aligned with previous print
             code_file = truncate_module_name(prefix, module)
             print(f"      no suggestion     {code_file}")
@@ -301,52 +371,66 @@ def suggest_order(results: list[RoadmapRow], module_map: ModuleMap, match_type:
         print(f"{lib:40} {start:08x}")
 
 
-def print_text_report(results: list[RoadmapRow]):
+def write_lines(lines: Iterable[str], chunk_size: int = 4096):
+    """Write the lines to stdout. Instead of calling print() for each one,
+    we collect a chunk of lines and output them with a single write."""
+    chunk: list[str] = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            sys.stdout.write("\n".join(chunk) + "\n")
+            chunk.clear()
+
+    if chunk:
+        sys.stdout.write("\n".join(chunk) + "\n")
+
+
+def print_text_report(results: Iterable[RoadmapRow]):
     """Print the result with original and recomp addresses."""
-    for row in results:
-        print(
-            "  ".join(
-                [
-                    f"{or_blank(row.orig_sect_ofs):14}",
-                    f"{or_blank(row.recomp_sect_ofs):14}",
-                    f"{or_blank(row.displacement):>8}",
-                    f"{row.sym_type:3}",
-                    f"{or_blank(row.size):6}",
-                    or_blank(row.name),
-                ]
-            )
-        )
+    write_lines(
+        f"{or_blank(row.orig_sect_ofs):14}  "
+        f"{or_blank(row.recomp_sect_ofs):14}  "
+        f"{or_blank(row.displacement):>8}  "
+        f"{row.sym_type:3}  "
+        f"{or_blank(row.size):6}  "
+        f"{or_blank(row.name)}"
+        for row in results
+    )
 
 
-def print_diff_report(results: list[RoadmapRow]):
+def print_diff_report(results: Iterable[RoadmapRow]):
     """Print only entries where we have the recomp address.
     This is intended for generating a file to diff against.
     The recomp addresses are always changing so we hide those."""
-    for row in results:
-        if row.orig_addr is None or row.recomp_addr is None:
-            continue
-
-        print(
-            "  ".join(
-                [
-                    f"{or_blank(row.orig_sect_ofs):14}",
-                    f"{or_blank(row.displacement):>8}",
-                    f"{row.sym_type:3}",
-                    f"{or_blank(row.size):6}",
-                    or_blank(row.name),
-                ]
-            )
-        )
+    write_lines(
+        f"{or_blank(row.orig_sect_ofs):14}  "
+        f"{or_blank(row.displacement):>8}  "
+        f"{row.sym_type:3}  "
+        f"{or_blank(row.size):6}  "
+        f"{or_blank(row.name)}"
+        for row in results
+        if row.orig_addr is not None and row.recomp_addr is not None
+    )
 
 
-def export_to_csv(csv_file: str, results: list[RoadmapRow]):
-    with open(csv_file, "w+", encoding="utf-8") as f:
-        f.write(
-            "orig_sect_ofs,recomp_sect_ofs,orig_addr,recomp_addr,displacement,row_type,size,name,module\n"
+def export_to_csv(csv_file: str, results: Iterable[RoadmapRow]):
+    with open(csv_file, "w", encoding="utf-8", newline="", buffering=1 << 20) as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(
+            [
+                "orig_sect_ofs",
+                "recomp_sect_ofs",
+                "orig_addr",
+                "recomp_addr",
+                "displacement",
+                "row_type",
+                "size",
+                "name",
+                "module",
+            ]
         )
-        for row in results:
-            f.write(",".join(map(or_blank, row)))
-            f.write("\n")
+        # The csv writer already writes None as a blank field.
+        writer.writerows(results)
 
 
 def parse_args() -> argparse.Namespace:
@@ -391,20 +475,25 @@ def main() -> int:
     orig_bin = engine.orig_bin
     recomp_bin = engine.recomp_bin
 
-    module_map = ModuleMap(target.recompiled_pdb, recomp_bin)
+    # The module name is only shown in the suggested order and the CSV export.
+    # Skip reading the modules from the pdb if we don't need them.
+    module_map: ModuleMap | None = None
+    if args.order is not None or args.csv is not None:
+        module_map = ModuleMap(target.recompiled_pdb, recomp_bin)
+
+    orig_section_names = tuple(section.name for section in orig_bin.sections)
+    recomp_section_names = tuple(section.name for section in recomp_bin.sections)
 
     def is_same_section(orig: int, recomp: int) -> bool:
         """Compare the section name instead of the index.
         LEGO1.dll adds extra sections for some reason. (Smacker library?)"""
 
         try:
-            orig_name = orig_bin.sections[orig - 1].name
-            recomp_name = recomp_bin.sections[recomp - 1].name
-            return orig_name == recomp_name
+            return orig_section_names[orig - 1] == recomp_section_names[recomp - 1]
         except IndexError:
             return False
 
-    def to_roadmap_row(match: ReccmpEntity):
+    def to_roadmap_row(match: ReccmpEntity, module_name: str | None):
         orig_sect = None
         orig_ofs = None
         orig_sect_ofs = None
@@ -414,13 +503,6 @@ def to_roadmap_row(match: ReccmpEntity):
         orig_addr = None
         recomp_addr = None
         displacement = None
-        module_name = None
-
-        if match.recomp_addr is not None and recomp_bin.is_valid_vaddr(
-            match.recomp_addr
-        ):
-            if (module_ref := module_map.get_module(match.recomp_addr)) is not None:
-                (_, module_name) = module_ref
 
         row_type = match_type_abbreviation(match.entity_type)
 
@@ -455,18 +537,46 @@ def to_roadmap_row(match: ReccmpEntity):
             module_name,
         )
 
-    def roadmap_row_generator(matches):
+    def get_module_name(match: ReccmpEntity) -> str | None:
+        # No module map means the report does not show the module.
+        if module_map is None:
+            return None
+
+        if match.recomp_addr is None or not recomp_bin.is_valid_vaddr(
+            match.recomp_addr
+        ):
+            return None
+
+        if (module_ref := module_map.get_module(match.recomp_addr)) is not None:
+            (_, module_name) = module_ref
+            return module_name
+
+        return None
+
+    def roadmap_row_generator(matches: Iterable[ReccmpEntity]):
         for match in matches:
             try:
-                yield to_roadmap_row(match)
+                yield to_roadmap_row(match, get_module_name(match))
             except InvalidVirtualAddressError:
                 # This is here to work around the fact that we have RVA
                 # values (i.e. not real virtual addrs) in our compare db.
                 pass
 
-    results = list(roadmap_row_generator(engine.get_all()))
+    matches: Iterable[ReccmpEntity] = engine.get_all()
+    if args.order is None and args.csv is None and not args.verbose:
+        # The diff report only shows entities that have both addresses.
+        # Drop the others now so we don't create rows for them.
+        matches = (
+            match
+            for match in matches
+            if match.orig_addr is not None and match.recomp_addr is not None
+        )
+
+    # Each report reads the rows once, so we can stream them.
+    results = roadmap_row_generator(matches)
 
     if args.order is not None:
+        assert module_map is not None
         suggest_order(results, module_map, args.order)
         return 0
 
@@ -1,8 +1,9 @@
+from collections import defaultdict
 from dataclasses import dataclass
+import heapq
 import re
 import logging
 import argparse
-import struct
 from typing import NamedTuple, Sequence
 
 import colorama
@@ -32,9 +33,13 @@
 UNCLEAR_ICON = f"{colorama.Fore.BLUE}?{colorama.Style.RESET_ALL}"
 
 
-STACK_ENTRY_REGEX = re.compile(
-    r"(?P<register>e[sb]p)\s(?P<sign>[+-])\s(?P<offset>(0x)?[0-9a-f]+)(?![0-9a-f])"
-)
+# Groups: 1 = register, 2 = sign, 3 = offset (hex digits without the 0x prefix)
+# The offset must not be followed by another word character, so that
+# an index register like "eax*4" is not read as the offset 0xea.
+STACK_ENTRY_REGEX = re.compile(r"(e[sb]p)\s([+-])\s(?:0x)?([0-9a-f]+)(?!\w)")
+
+# Any use of a stack register. Only checked to log instructions we did not match.
+STACK_REGISTER_REGEX = re.compile(r"e[sb]p")
 
 
 @dataclass
@@ -43,7 +48,7 @@ class StackSymbol:
     data_type: str
 
 
-@dataclass
+@dataclass(slots=True)
 class StackRegisterOffset:
     register: str
     offset: int
@@ -59,7 +64,8 @@ def __str__(self) -> str:
         return first_part + second_part
 
     def __hash__(self) -> int:
-        return hash(self.register) + self.offset
+        # The symbol is not part of the identity because it is assigned later.
+        return hash((self.register, self.offset))
 
     def copy(self) -> "StackRegisterOffset":
         return StackRegisterOffset(self.register, self.offset, self.symbol)
@@ -72,6 +78,10 @@ def __eq__(self, other: object):
         )
 
 
+def stack_offset_sort_key(offset: StackRegisterOffset) -> tuple[int, str]:
+    return (offset.offset, offset.register)
+
+
 class StackPair(NamedTuple):
     orig: StackRegisterOffset
     recomp: StackRegisterOffset
@@ -79,6 +89,9 @@ class StackPair(NamedTuple):
 
 StackPairs = set[StackPair]
 
+# Maps a stack offset on one side to the matching offsets on the other side
+StackOffsetMap = dict[StackRegisterOffset, list[StackRegisterOffset]]
+
 
 @dataclass
 class Warnings:
@@ -92,12 +105,17 @@ def extract_stack_offset_from_instruction(
     match = STACK_ENTRY_REGEX.search(instruction)
     if not match:
         return None
-    offset = int(match.group("sign") + match.group("offset"), 16)
-    return StackRegisterOffset(match.group("register"), offset)
+    (register, sign, digits) = match.groups()
+    offset = int(sign + digits, 16)
+    return StackRegisterOffset(register, offset)
 
 
 def analyze_diff(diff: MatchingOrMismatchingBlock, warnings: Warnings) -> StackPairs:
     stack_pairs: StackPairs = set()
+
+    # Skip the search for unmatched stack registers if we would not log them.
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+
     if "both" in diff:
         # get the matching stack entries
         for line in diff["both"]:
@@ -108,7 +126,7 @@ def analyze_diff(diff: MatchingOrMismatchingBlock, warnings: Warnings) -> StackP
                 logging.debug("stack match: %s", match)
                 # need a copy for recomp because we might add a debug symbol to it
                 stack_pairs.add(StackPair(match, match.copy()))
-            elif any(x in instruction for x in ["ebp", "esp"]):
+            elif debug_enabled and STACK_REGISTER_REGEX.search(instruction):
                 logging.debug("not a stack offset: %s", instruction)
 
     else:
@@ -150,7 +168,7 @@ def analyze_diff(diff: MatchingOrMismatchingBlock, warnings: Warnings) -> StackP
                 )
                 stack_pairs.add(stack_pair)
 
-            elif any(x in orig_line[1] for x in ["ebp", "esp"]):
+            elif debug_enabled and STACK_REGISTER_REGEX.search(orig_line[1]):
                 logging.debug("not a stack offset: %s", orig_line[1])
 
     return stack_pairs
@@ -187,7 +205,7 @@ def compare_function_stacks(udiff: CombinedDiffOutput, fn_symbol: SymbolsEntry):
     for block in udiff:
         # block[0] is e.g. "@@ -0x10071662,60 +0x10031368,60 @@"
         for diff in block[1]:
-            stack_pairs = stack_pairs.union(analyze_diff(diff, warnings))
+            stack_pairs.update(analyze_diff(diff, warnings))
 
     # Note that the 'Frame Ptr Present' property is not relevant to the stack below `ebp`,
     # but only to entries above (i.e. the function arguments on the stack).
@@ -198,8 +216,8 @@ def compare_function_stacks(udiff: CombinedDiffOutput, fn_symbol: SymbolsEntry):
     for symbol in fn_symbol.stack_symbols:
         if symbol.symbol_type == "S_BPREL32":
             # convert hex to signed 32 bit integer
-            hex_bytes = bytes.fromhex(symbol.location[1:-1])
-            stack_offset = struct.unpack(">l", hex_bytes)[0]
+            raw = int(symbol.location[1:-1], 16)
+            stack_offset = raw - 0x100000000 if raw & 0x80000000 else raw
 
             stack_symbols[stack_offset] = StackSymbol(
                 symbol.name,
@@ -214,20 +232,35 @@ def compare_function_stacks(udiff: CombinedDiffOutput, fn_symbol: SymbolsEntry):
                 "Matching esp offsets to debug symbols is not implemented right now"
             )
 
-    print_by_original_stack(stack_pairs, warnings)
-    print_by_recomp_stack(stack_pairs, stack_symbols, warnings)
-    print_footer(warnings)
+    # Index the pairs from both sides so each printer can walk them directly.
+    by_orig: StackOffsetMap = defaultdict(list)
+    by_recomp: StackOffsetMap = defaultdict(list)
+    for orig, recomp in stack_pairs:
+        by_orig[orig].append(recomp)
+        by_recomp[recomp].append(orig)
 
+    # Sort each side once here so the printers can walk them in order.
+    sorted_origs = sorted(by_orig.keys(), key=stack_offset_sort_key)
+    sorted_recomps = sorted(by_recomp.keys(), key=stack_offset_sort_key)
 
-def print_by_original_stack(stack_pairs: set[StackPair], warnings: Warnings):
-    print("\nOrdered by original stack (left=orig, right=recomp):")
+    # Also sort the matches for each offset so that m:n output is stable.
+    for offsets in (*by_orig.values(), *by_recomp.values()):
+        offsets.sort(key=stack_offset_sort_key)
+
+    print_by_original_stack(sorted_origs, by_orig, warnings)
+    print_by_recomp_stack(sorted_recomps, by_recomp, stack_symbols, warnings)
+    print_footer(warnings)
 
-    all_orig_offsets = set(x.orig.offset for x in stack_pairs)
 
-    for orig_offset in sorted(all_orig_offsets):
-        orig = next(x.orig for x in stack_pairs if x.orig.offset == orig_offset)
-        recomps = [x.recomp for x in stack_pairs if x.orig == orig]
+def print_by_original_stack(
+    sorted_origs: list[StackRegisterOffset],
+    by_orig: StackOffsetMap,
+    warnings: Warnings,
+):
+    print("\nOrdered by original stack (left=orig, right=recomp):")
 
+    for orig in sorted_origs:
+        recomps = by_orig[orig]
         if len(recomps) == 1:
             recomp = recomps[0]
             print_bijective_match(str(orig), str(recomp), exact=orig == recomp)
@@ -237,22 +270,26 @@ def print_by_original_stack(stack_pairs: set[StackPair], warnings: Warnings):
 
 
 def print_by_recomp_stack(
-    stack_pairs: set[StackPair],
+    sorted_recomps: list[StackRegisterOffset],
+    by_recomp: StackOffsetMap,
     stack_symbols: dict[int, StackSymbol],
     warnings: Warnings,
 ):
+    # Keys are inserted in ascending order of offset.
+    recomps_by_offset: dict[int, list[StackRegisterOffset]] = defaultdict(list)
+    for recomp in sorted_recomps:
+        recomps_by_offset[recomp.offset].append(recomp)
+
     # Show offsets from the debug symbols that we have not encountered in the diff
-    all_recomp_offsets = set(x.recomp.offset for x in stack_pairs).union(
-        stack_symbols.keys()
+    unseen_offsets = sorted(
+        offset for offset in stack_symbols if offset not in recomps_by_offset
     )
 
     print("\nOrdered by recomp stack (left=orig, right=recomp):")
-    for recomp_offset in sorted(all_recomp_offsets):
-        recomp = next(
-            (x.recomp for x in stack_pairs if x.recomp.offset == recomp_offset), None
-        )
+    for recomp_offset in heapq.merge(recomps_by_offset.keys(), unseen_offsets):
+        recomps = recomps_by_offset.get(recomp_offset)
 
-        if recomp is None:
+        if not recomps:
             # The offset only appears in the debug symbols.
             # The legend below explains why this can happen.
             stack_offset = StackRegisterOffset(
@@ -261,14 +298,15 @@ def print_by_recomp_stack(
             print(f"{UNCLEAR_ICON}  not seen:   {stack_offset}")
             continue
 
-        origs = [x.orig for x in stack_pairs if x.recomp == recomp]
+        for recomp in recomps:
+            origs = by_recomp[recomp]
 
-        if len(origs) == 1:
-            # 1:1 clean match
-            print_bijective_match(str(origs[0]), str(recomp), origs[0] == recomp)
-        else:
-            print_non_bijective_match(format_list_of_offsets(origs), str(recomp))
-            warnings.error_map_not_bijective = True
+            if len(origs) == 1:
+                # 1:1 clean match
+                print_bijective_match(str(origs[0]), str(recomp), origs[0] == recomp)
+            else:
+                print_non_bijective_match(format_list_of_offsets(origs), str(recomp))
+                warnings.error_map_not_bijective = True
 
 
 def print_footer(warnings: Warnings):
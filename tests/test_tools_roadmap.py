@@ -0,0 +1,281 @@
+"""Tests for the helper functions of the reccmp-roadmap tool."""
+
+import statistics
+from pathlib import Path
+from typing import NamedTuple, cast
+import pytest
+from reccmp.isledecomp import PEImage
+from reccmp.isledecomp.cvdump.parser import ModuleEntry, SizeRefEntry
+from reccmp.tools import roadmap
+from reccmp.tools.roadmap import (
+    DeltaCollector,
+    ModuleMap,
+    RoadmapRow,
+    avg_remove_outliers,
+    export_to_csv,
+    print_diff_report,
+    read_pdb_modules,
+    write_lines,
+)
+
+
+def test_avg_one_entry():
+    assert avg_remove_outliers([0x1000]) == 0x1000
+
+
+def test_avg_no_outliers():
+    assert avg_remove_outliers([10, 20, 30]) == 20
+    assert avg_remove_outliers([5, 5, 5, 5]) == 5
+
+
+def test_avg_removes_outlier():
+    entries = [0x1000] * 10 + [0x9000]
+    assert avg_remove_outliers(entries) == 0x1000
+
+
+@pytest.mark.parametrize(
+    "entries",
+    (
+        [0x10001000, 0x10001200, 0x10003000, 0x10020000],
+        [0x10001000 + 16 * i for i in range(100)] + [0x10100000],
+        [1, 2, 3, 4, 100, 200, 300, 400, 50000],
+    ),
+)
+def test_avg_same_as_statistics(entries: list[int]):
+    """Should match the result of the naive version using the statistics module."""
+    avg = statistics.mean(entries)
+    sd = statistics.pstdev(entries)
+    expected = int(statistics.mean([e for e in entries if abs(e - avg) <= 2 * sd]))
+
+    assert avg_remove_outliers(entries) == expected
+
+
+def test_export_to_csv(tmp_path):
+    """None values should be written as blank fields.
+    Names that contain a comma must be quoted."""
+    csv_file = tmp_path / "roadmap.csv"
+    rows = [
+        RoadmapRow(
+            "0001:00000010",
+            "0001:00000020",
+            0x1000,
+            0x2000,
+            0x10,
+            "fun",
+            16,
+            "Test::Test",
+            "test.obj",
+        ),
+        RoadmapRow(
+            "0001:00000030", None, 0x1020, None, None, "fun", 8, "Map<int,int>", None
+        ),
+    ]
+    export_to_csv(str(csv_file), rows)
+
+    assert csv_file.read_text(encoding="utf-8").splitlines() == [
+        "orig_sect_ofs,recomp_sect_ofs,orig_addr,recomp_addr,displacement,row_type,size,name,module",
+        "0001:00000010,0001:00000020,4096,8192,16,fun,16,Test::Test,test.obj",
+        '0001:00000030,,4128,,,fun,8,"Map<int,int>",',
+    ]
+
+
+def test_print_diff_report(capsys):
+    """Only rows with both addresses are shown. The columns are aligned."""
+    rows = [
+        RoadmapRow(
+            "0001:00000010",
+            "0001:00000020",
+            0x1000,
+            0x2000,
+            0x10,
+            "fun",
+            16,
+            "Test::Test",
+            "test.obj",
+        ),
+        RoadmapRow(
+            "0001:00000030", None, 0x1020, None, None, "fun", 8, "Test::Run", None
+        ),
+    ]
+    print_diff_report(rows)
+
+    assert capsys.readouterr().out == (
+        "0001:00000010         16  fun  16      Test::Test\n"
+    )
+
+
+def test_write_lines_chunks(capsys):
+    """Should write all lines regardless of the chunk size."""
+    write_lines((str(i) for i in range(10)), chunk_size=3)
+    assert capsys.readouterr().out == "".join(f"{i}\n" for i in range(10))
+
+
+def test_delta_collector():
+    """Should aggregate the addresses and displacements for each module
+    using only rows of the selected symbol type."""
+    rows = [
+        RoadmapRow(None, None, 0x1020, 0x2000, 0x10, "fun", 16, "A", "a.obj"),
+        RoadmapRow(None, None, 0x1000, 0x2010, -0x8, "fun", 16, "B", "a.obj"),
+        RoadmapRow(None, None, 0x1100, None, None, "fun", 16, "C", "b.obj"),
+        RoadmapRow(None, None, 0x0500, 0x0600, 0x100, "dat", 4, "D", "b.obj"),
+        RoadmapRow(None, None, 0x0100, None, None, "fun", 16, "E", None),
+    ]
+    dc = DeltaCollector("fun")
+    dc.read_rows(rows)
+
+    assert dc.addresses == {"a.obj": [0x1020, 0x1000], "b.obj": [0x1100]}
+    assert dc.disp_map == {"a.obj": [0x10, -0x8]}
+    assert dc.earliest == {"a.obj": 0x1000, "b.obj": 0x1100}
+    assert list(dc.iter_sorted()) == [(0x1010, "a.obj"), (0x1100, "b.obj")]
+
+
+class FakeCvdumpResult:
+    modules = [ModuleEntry(1, "test.lib", "test.obj")]
+    sizerefs = [SizeRefEntry(module=1, section=1, offset=0x10, size=0x20)]
+
+
+class FakeCvdump:
+    """Stand-in for the Cvdump runner that counts how often it runs."""
+
+    runs = 0
+
+    def __init__(self, _: str):
+        pass
+
+    def section_contributions(self):
+        return self
+
+    def modules(self):
+        return self
+
+    def run(self):
+        FakeCvdump.runs += 1
+        return FakeCvdumpResult()
+
+
+def test_read_pdb_modules_cache(tmp_path, monkeypatch):
+    """Should only run cvdump again if the pdb changes."""
+    monkeypatch.setattr(roadmap, "Cvdump", FakeCvdump)
+    FakeCvdump.runs = 0
+
+    pdb = tmp_path / "test.pdb"
+    pdb.write_bytes(b"pdb")
+
+    expected = (
+        [ModuleEntry(1, "test.lib", "test.obj")],
+        [SizeRefEntry(module=1, section=1, offset=0x10, size=0x20)],
+    )
+
+    assert read_pdb_modules(pdb) == expected
+    assert FakeCvdump.runs == 1
+    assert (tmp_path / "test.pdb.reccmp-cache").exists()
+
+    # Read from the cache
+    assert read_pdb_modules(pdb) == expected
+    assert FakeCvdump.runs == 1
+
+    # Changed size invalidates the cache
+    pdb.write_bytes(b"new pdb")
+    assert read_pdb_modules(pdb) == expected
+    assert FakeCvdump.runs == 2
+
+
+def test_read_pdb_modules_bad_cache(tmp_path, monkeypatch):
+    """Should replace a cache file that cannot be read."""
+    monkeypatch.setattr(roadmap, "Cvdump", FakeCvdump)
+    FakeCvdump.runs = 0
+
+    pdb = tmp_path / "test.pdb"
+    pdb.write_bytes(b"pdb")
+    (tmp_path / "test.pdb.reccmp-cache").write_bytes(b"garbage")
+
+    read_pdb_modules(pdb)
+    assert FakeCvdump.runs == 1
+
+    read_pdb_modules(pdb)
+    assert FakeCvdump.runs == 1
+
+
+class FakeSection(NamedTuple):
+    virtual_address: int
+
+
+class FakeBinfile(NamedTuple):
+    sections: list[FakeSection]
+
+
+def test_module_map(monkeypatch):
+    """Section contributions are sorted by address and those in sections
+    not listed in the binfile are dropped. Lookups between or outside of
+    the contributions return None."""
+    modules = [
+        ModuleEntry(1, "a.lib", "a.obj"),
+        ModuleEntry(2, "b.lib", "b.obj"),
+        ModuleEntry(3, "c.lib", "c.obj"),
+    ]
+    sizerefs = [
+        SizeRefEntry(module=2, section=2, offset=0, size=0x100),
+        SizeRefEntry(module=1, section=1, offset=0x100, size=0x20),
+        SizeRefEntry(module=1, section=1, offset=0x10, size=0x20),
+        # Sections that do not exist in the binfile
+        SizeRefEntry(module=3, section=3, offset=0x200, size=0x20),
+        SizeRefEntry(module=3, section=0, offset=0x200, size=0x20),
+    ]
+    monkeypatch.setattr(roadmap, "read_pdb_modules", lambda _: (modules, sizerefs))
+
+    binfile = FakeBinfile([FakeSection(0x10001000), FakeSection(0x10010000)])
+    module_map = ModuleMap(Path("test.pdb"), cast(PEImage, binfile))
+
+    assert module_map.contrib_starts == [0x10001010, 0x10001100, 0x10010000]
+
+    # Before the first contribution
+    assert module_map.get_module(0x10001000) is None
+
+    assert module_map.get_module(0x10001010) == ("a.lib", "a.obj")
+    assert module_map.get_module(0x1000102F) == ("a.lib", "a.obj")
+
+    # In the gap between contributions
+    assert module_map.get_module(0x10001030) is None
+
+    assert module_map.get_module(0x10001110) == ("a.lib", "a.obj")
+    assert module_map.get_module(0x100100FF) == ("b.lib", "b.obj")
+
+    # Past the end of the last contribution
+    assert module_map.get_module(0x10010100) is None
+    assert module_map.get_module(0x10010200) is None
+    assert module_map.get_module(0x20000000) is None
+
+
+def test_read_pdb_modules_old_cache_format(tmp_path, monkeypatch):
+    """Should not use a cache file written with a different format."""
+    monkeypatch.setattr(roadmap, "Cvdump", FakeCvdump)
+    FakeCvdump.runs = 0
+
+    pdb = tmp_path / "test.pdb"
+    pdb.write_bytes(b"pdb")
+
+    read_pdb_modules(pdb)
+    assert FakeCvdump.runs == 1
+
+    monkeypatch.setattr(roadmap, "PDB_CACHE_FORMAT", roadmap.PDB_CACHE_FORMAT + 1)
+    read_pdb_modules(pdb)
+    assert FakeCvdump.runs == 2
+
+
+def test_read_pdb_modules_write_error(tmp_path, monkeypatch):
+    """Should not leave the temp file behind if the cache cannot be written."""
+    monkeypatch.setattr(roadmap, "Cvdump", FakeCvdump)
+
+    def replace_error(*_):
+        raise OSError("test")
+
+    monkeypatch.setattr(roadmap.os, "replace", replace_error)
+
+    pdb = tmp_path / "test.pdb"
+    pdb.write_bytes(b"pdb")
+
+    assert read_pdb_modules(pdb) == (
+        FakeCvdumpResult.modules,
+        FakeCvdumpResult.sizerefs,
+    )
+    assert [p.name for p in tmp_path.iterdir()] == ["test.pdb"]
@@ -0,0 +1,201 @@
+"""Tests for the output of the reccmp-stackcmp tool."""
+
+import re
+import pytest
+from reccmp.isledecomp.compare.diff import CombinedDiffOutput
+from reccmp.isledecomp.cvdump.symbols import StackOrRegisterSymbol, SymbolsEntry
+from reccmp.tools.stackcmp import (
+    StackRegisterOffset,
+    compare_function_stacks,
+    extract_stack_offset_from_instruction,
+)
+
+
+def bprel32(location: str, name: str) -> StackOrRegisterSymbol:
+    return StackOrRegisterSymbol("S_BPREL32", location, "T_INT4(0074)", name)
+
+
+def run_compare(
+    capsys, udiff: CombinedDiffOutput, stack_symbols: list[StackOrRegisterSymbol]
+) -> list[str]:
+    """Return the lines of the two stack listings without the legend
+    and without color codes."""
+    fn_symbol = SymbolsEntry(
+        type="S_GPROC32",
+        section=1,
+        offset=0,
+        size=0x100,
+        func_type="T_NOTYPE(0000)",
+        name="Test",
+        stack_symbols=stack_symbols,
+    )
+    compare_function_stacks(udiff, fn_symbol)
+    output = re.sub(r"\x1b\[[0-9;]*m", "", capsys.readouterr().out)
+    return output.split("\nLegend:")[0].strip().splitlines()
+
+
+def test_one_to_one(capsys):
+    udiff: CombinedDiffOutput = [
+        (
+            "@@ -0x1000,2 +0x2000,2 @@",
+            [
+                {
+                    "both": [
+                        ("0x1000", "mov eax, dword ptr [ebp - 0x8]", "0x2000"),
+                        ("0x1003", "push ebp", "0x2003"),
+                    ]
+                }
+            ],
+        )
+    ]
+
+    assert run_compare(capsys, udiff, [bprel32("[fffffff8]", "a")]) == [
+        "Ordered by original stack (left=orig, right=recomp):",
+        "✓  ebp - 0x08: ebp - 0x08  a",
+        "",
+        "Ordered by recomp stack (left=orig, right=recomp):",
+        "✓  ebp - 0x08: ebp - 0x08  a",
+    ]
+
+
+def test_many_to_many(capsys):
+    """Two orig offsets use the same recomp offset."""
+    udiff: CombinedDiffOutput = [
+        (
+            "@@ -0x1000,2 +0x2000,2 @@",
+            [
+                {
+                    "orig": [
+                        ("0x1000", "mov eax, dword ptr [ebp - 0xc]"),
+                        ("0x1003", "mov ecx, dword ptr [ebp - 0x14]"),
+                    ],
+                    "recomp": [
+                        ("0x2000", "mov eax, dword ptr [ebp - 0x14]"),
+                        ("0x2003", "mov ecx, dword ptr [ebp - 0x14]"),
+                    ],
+                }
+            ],
+        )
+    ]
+
+    assert run_compare(capsys, udiff, []) == [
+        "Ordered by original stack (left=orig, right=recomp):",
+        "✓  ebp - 0x14: ebp - 0x14",
+        "⇄  ebp - 0x0c: ebp - 0x14",
+        "",
+        "Ordered by recomp stack (left=orig, right=recomp):",
+        "✗  ['ebp - 0x14', 'ebp - 0x0c']: ebp - 0x14",
+    ]
+
+
+def test_ebp_and_esp_same_offset(capsys):
+    """ebp and esp entries at the same offset are listed separately."""
+    udiff: CombinedDiffOutput = [
+        (
+            "@@ -0x1000,2 +0x2000,2 @@",
+            [
+                {
+                    "both": [
+                        ("0x1000", "mov eax, dword ptr [esp + 0x10]", "0x2000"),
+                        ("0x1004", "mov ecx, dword ptr [ebp + 0x10]", "0x2004"),
+                    ]
+                }
+            ],
+        )
+    ]
+
+    assert run_compare(capsys, udiff, []) == [
+        "Ordered by original stack (left=orig, right=recomp):",
+        "✓  ebp + 0x10: ebp + 0x10",
+        "✓  esp + 0x10: esp + 0x10",
+        "",
+        "Ordered by recomp stack (left=orig, right=recomp):",
+        "✓  ebp + 0x10: ebp + 0x10",
+        "✓  esp + 0x10: esp + 0x10",
+    ]
+
+
+def test_symbol_not_seen(capsys):
+    """Debug symbols that do not appear in the diff are shown in order
+    with the offsets from the diff."""
+    udiff: CombinedDiffOutput = [
+        (
+            "@@ -0x1000,2 +0x2000,2 @@",
+            [
+                {
+                    "both": [
+                        ("0x1000", "mov eax, dword ptr [ebp - 0x8]", "0x2000"),
+                        ("0x1003", "mov ecx, dword ptr [ebp + 0x8]", "0x2003"),
+                    ]
+                }
+            ],
+        )
+    ]
+    stack_symbols = [
+        bprel32("[fffffff8]", "a"),
+        bprel32("[00000008]", "b"),
+        bprel32("[fffffff0]", "c"),
+        bprel32("[00000000]", "d"),
+        bprel32("[0000000c]", "e"),
+    ]
+
+    assert run_compare(capsys, udiff, stack_symbols) == [
+        "Ordered by original stack (left=orig, right=recomp):",
+        "✓  ebp - 0x08: ebp - 0x08  a",
+        "✓  ebp + 0x08: ebp + 0x08  b",
+        "",
+        "Ordered by recomp stack (left=orig, right=recomp):",
+        "?  not seen:   ebp - 0x10  c",
+        "✓  ebp - 0x08: ebp - 0x08  a",
+        "?  not seen:   ebp - 0x00  d",
+        "✓  ebp + 0x08: ebp + 0x08  b",
+        "?  not seen:   ebp + 0x0c  e",
+    ]
+
+
+@pytest.mark.parametrize(
+    "location, expected",
+    (
+        ("[fffffff8]", "ebp - 0x08"),
+        ("[FFFFFFF8]", "ebp - 0x08"),
+        ("[80000000]", "ebp - 0x80000000"),
+        ("[00000008]", "ebp + 0x08"),
+        ("[7fffffff]", "ebp + 0x7fffffff"),
+    ),
+)
+def test_bprel32_location_sign(capsys, location: str, expected: str):
+    """The S_BPREL32 location is a signed 32-bit offset from ebp."""
+    assert run_compare(capsys, [], [bprel32(location, "x")])[-1] == (
+        f"?  not seen:   {expected}  x"
+    )
+
+
+@pytest.mark.parametrize(
+    "instruction, register, offset",
+    (
+        ("mov eax, dword ptr [ebp - 0x10]", "ebp", -0x10),
+        ("mov eax, dword ptr [esp + 4]", "esp", 4),
+        ("lea ecx, [esp + 0x1c]", "esp", 0x1C),
+        ("mov dword ptr [ebp + 0x8], 0x1234", "ebp", 0x8),
+        ("push dword ptr [ebp - 0x12ab]", "ebp", -0x12AB),
+    ),
+)
+def test_extract_stack_offset(instruction: str, register: str, offset: int):
+    assert extract_stack_offset_from_instruction(instruction) == StackRegisterOffset(
+        register, offset
+    )
+
+
+@pytest.mark.parametrize(
+    "instruction",
+    (
+        "push ebp",
+        "mov ebp, esp",
+        "mov eax, dword ptr [eax + 0x10]",
+        # Index registers start with hex digits but are not an offset
+        "mov eax, dword ptr [ebp + ecx*4]",
+        "mov eax, dword ptr [esp + eax*4 + 0x10]",
+    ),
+)
+def test_extract_stack_offset_no_match(instruction: str):
+    assert extract_stack_offset_from_instruction(instruction) is None